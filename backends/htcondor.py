@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
 
 from hpc_submit import BaseConfig, BaseBackend, ConfigError, shquote  # import from main module
 
@@ -21,8 +21,8 @@ class HtcondorConfig(BaseConfig):
         base.update({
             "pool": str(cls._req(ht, "pool")),
             "schedd": str(cls._req(ht, "schedd")),
-            "cpus": int(ht.get("cpus", cls.cpus)),
-            "gpus": int(ht.get("gpus", cls.gpus)),
+            "cpus": cls._int(ht, "cpus", cls.cpus),
+            "gpus": cls._int(ht, "gpus", cls.gpus),
             "ram": str(ht.get("ram", cls.ram)), 
         })
         return base
@@ -32,66 +32,91 @@ class HtcondorBackend(BaseBackend):
 
     PREFIX = "htcondor"
 
-    def _generate_sub(self, **kwargs) -> None:
-        singularity_bind = ",".join(self._get_singularity_binds())
-        sh = Path(kwargs.get("sh")).absolute()
-        job_sub = f"""
-universe              = vanilla
-executable            = {sh}
-arguments             = $(args)
-#transfer_executable   = NO
-should_transfer_files = NO
-request_cpus          = {self.config.cpus}
-{ f"request_gpus          = {self.config.gpus}" if self.config.gpus else "" }
-request_memory        = {self.config.ram}
-output                = {self.writer.outdir}/$(Cluster).$(Process).out
-error                 = {self.writer.outdir}/$(Cluster).$(Process).err
-log                   = {self.writer.outdir}/$(Cluster).log
-
-+SingularityJob       = True
-+SingularityImage     = "{self.config.image}"
-+SingularityBind      = "{singularity_bind}"
-
-PROJECT_DIR           = {self.MNT_PROJECT}
-DATA_DIR              = {self.MNT_DATA}
-OUTPUT_DIR            = {self.MNT_OUTPUT}/$(Cluster)
-environment           = PROJECT_DIR=$(PROJECT_DIR);DATA_DIR=$(DATA_DIR);OUTPUT_DIR=$(OUTPUT_DIR)
-
-queue { f"args from {self.config.inputs.absolute()}" if self.config.inputs else ""}
-"""
+    def _generate_sub(self) -> Tuple[str, str, int]:
+        singularity_bind = ",".join(self.singularity_binds)
+        sh = self.writer.path(self._filename(self.FILE_SH)).absolute()
+        outdir = self.writer.outdir
+        job_sub = [
+            "universe              = vanilla",
+            f"executable            = {sh}",
+            "arguments             = $(args)",
+            "#transfer_executable   = NO",
+            "should_transfer_files = NO",
+            f"request_cpus          = {self.config.cpus}",
+        ]
+        if self.config.gpus:
+            job_sub.append(f"request_gpus          = {self.config.gpus}")
+        job_sub += [
+            f"request_memory        = {self.config.ram}",
+            f"output                = {outdir}/$(Cluster).$(Process).out",
+            f"error                 = {outdir}/$(Cluster).$(Process).err",
+            f"log                   = {outdir}/$(Cluster).log",
+            "",
+            "+SingularityJob       = True",
+            f"+SingularityImage     = \"{self.config.image}\"",
+            f"+SingularityBind      = \"{singularity_bind}\"",
+            "",
+            f"PROJECT_DIR           = {self.MNT_PROJECT}",
+            f"DATA_DIR              = {self.MNT_DATA}",
+            f"OUTPUT_DIR            = {self.MNT_OUTPUT}/$(Cluster)",
+            "environment           = PROJECT_DIR=$(PROJECT_DIR);DATA_DIR=$(DATA_DIR);OUTPUT_DIR=$(OUTPUT_DIR)",
+            "",
+            f"queue args from {self.config.abs_inputs}" if self.config.abs_inputs else "queue",
+            "",
+        ]
         job_file = self._filename(self.FILE_JOB)
-        return self.writer.write_text(job_file, job_sub)
+        return job_file, "\n".join(job_sub), 0o644
 
         
-    def _generate_sh(self):
+    def _generate_sh(self) -> Tuple[str, str, int]:
         cmd = f"{"python3 " if self.config.executable.endswith(".py") else ""}{self.MNT_PROJECT}/{self.config.executable}"
-        source_venv = f"source {self.config.venv.absolute()}/bin/activate" if self.config.venv else ""
+        source_venv = f"source {self.config.abs_venv}/bin/activate" if self.config.abs_venv else ""
         script = f"""
 #!/bin/bash
 
-RAW_LINE="$@"
-mapfile -t ARGS < <(
-python3 - "$RAW_LINE" <<'PY'
-import os, sys, shlex
-line = sys.argv[1].strip()
-if line and not line.startswith("#"):
-    expanded = os.path.expandvars(line)
-    for arg in shlex.split(expanded):
-        print(arg)
-PY
-)
+# Split the queued args line without evaluating it: $VAR / ${{VAR}} are
+# expanded like os.path.expandvars (unset names stay literal), then xargs
+# splits on whitespace honouring quotes. Blank and comment lines give no args.
+RAW_LINE="$*"
+RAW_LINE="${{RAW_LINE#"${{RAW_LINE%%[![:space:]]*}}"}}"
+ARGS=()
+if [[ -n "$RAW_LINE" && "$RAW_LINE" != "#"* ]]; then
+    EXPANDED=""
+    VAR_RE='^([^$]*)\\$([A-Za-z0-9_]+|\\{{[^}}]*\\}})(.*)$'
+    while [[ "$RAW_LINE" == *\\$* ]]; do
+        if [[ ! "$RAW_LINE" =~ $VAR_RE ]]; then
+            # the first $ starts no name: keep it and look past it
+            EXPANDED+="${{RAW_LINE%%\\$*}}\\$"
+            RAW_LINE="${{RAW_LINE#*\\$}}"
+            continue
+        fi
+        EXPANDED+="${{BASH_REMATCH[1]}}"
+        VAR_REF="${{BASH_REMATCH[2]}}"
+        RAW_LINE="${{BASH_REMATCH[3]}}"
+        VAR_NAME="${{VAR_REF#\\{{}}"
+        VAR_NAME="${{VAR_NAME%\\}}}}"
+        if [[ "$VAR_NAME" =~ ^[A-Za-z_][A-Za-z0-9_]*$ && -n "${{!VAR_NAME+set}}" ]]; then
+            EXPANDED+="${{!VAR_NAME}}"
+        else
+            EXPANDED+="\\$$VAR_REF"
+        fi
+    done
+    EXPANDED+="$RAW_LINE"
+    mapfile -d '' -t ARGS < <(printf '%s\\n' "$EXPANDED" | xargs -r printf '%s\\0')
+    wait $! || {{ echo "job.sh: cannot split args line: $*" >&2; exit 2; }}
+fi
 
 mkdir -p ${{OUTPUT_DIR}}
 {source_venv}
 {cmd} "${{ARGS[@]}}"
 """
         script_file = self._filename(self.FILE_SH)
-        return self.writer.write_text(script_file, script, mode=0o755)
+        return script_file, script, 0o755
   
 
-    def _generate_htcondor_submit(self, **kwargs) -> Path:
-        venv = kwargs.get("venv")
-        sub = kwargs.get("sub")
+    def _generate_htcondor_submit(self) -> Tuple[str, str, int]:
+        venv = self.writer.path(self._filename(self.FILE_VENV))
+        sub = self.writer.path(self._filename(self.FILE_JOB))
         script = f"""
 #!/bin/bash
 {venv.absolute() if venv else ""}
@@ -99,12 +124,14 @@ echo "Submitting job(s)..."
 condor_submit -pool {self.config.pool} -name {self.config.schedd} {sub.absolute()}
 """ 
         script_file = self._filename(self.FILE_SUBMIT)
-        return self.writer.write_text(script_file, script, mode=0o755)
+        return script_file, script, 0o755
 
 
     def generate(self) -> Path:
-        venv = self._generate_venv()
-        sh = self._generate_sh()
-        sub = self._generate_sub(sh=sh)
-        submit_script = self._generate_htcondor_submit(venv=venv, sub=sub)
+        *_, submit_script = self.writer.write_batch([
+            self._generate_venv(),
+            self._generate_sh(),
+            self._generate_sub(),
+            self._generate_htcondor_submit(),
+        ])
         return submit_script
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+import shlex
+
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from hpc_submit import BaseConfig, BaseBackend, ConfigError, shquote
 
@@ -11,7 +13,7 @@ class SpacehpcConfig(BaseConfig):
     login_node: str = ""
     user: str = ""
     ssh_key: Path = Path()
-    project: str = ""
+    pbs_project: str = ""  # spacehpc.project; BaseConfig.project stays the local project dir
     queue: str = ""
     nodes: int = 1
     cpus: int = 1
@@ -19,6 +21,8 @@ class SpacehpcConfig(BaseConfig):
     ram: str = "1G"
     walltime: str = "00:10:00"
     job_name: str = "hpc_submit"
+    scratch_dir: str = ""
+    projects_dir: str = ""
 
     # where to place the venv on remote (if top-level venv is empty)
     venv_default_remote: str = ".venv"  # relative to REMOTE_PROJECT_ROOT
@@ -27,33 +31,82 @@ class SpacehpcConfig(BaseConfig):
     def parse(cls, merged: Dict[str, Any]) -> Dict[str, Any]:
         base = super().parse(merged)
         sp = merged.get("spacehpc", {}) or {}
-        
-        base.update({"login_node": str(cls._req(sp, "login_node"))})
-        base.update({"user": str(cls._req(sp, "user"))})
-        base.update({"ssh_key": str(cls._req(sp, "ssh_key"))})
-        base.update({"project": str(cls._req(sp, "project"))})
-        base.update({"queue": str(sp.get("queue"))})
-        base.update({"nodes": int(sp.get("nodes", 1))})
-        base.update({"cpus": int(sp.get("cpus", 1))})
-        base.update({"gpus": int(sp.get("gpus", 1))})
-        base.update({"ram": str(sp.get("ram", "1G"))})
-        base.update({"walltime": str(sp.get("walltime", "00:10:00"))})
-        base.update({"job_name": int(sp.get("job_name", "hpc_submit"))})
+        # optional in BaseConfig, but generate() stages all three to the cluster
+        for key in ("data_dir", "output_dir", "image"):
+            cls._req(base, key)
+
+        base.update({
+            "login_node": str(cls._req(sp, "login_node")),
+            "user": str(cls._req(sp, "user")),
+            "ssh_key": str(cls._req(sp, "ssh_key")),
+            "pbs_project": str(cls._req(sp, "project")),
+            "queue": str(sp.get("queue") or ""),
+            "nodes": cls._int(sp, "nodes", 1),
+            "cpus": cls._int(sp, "cpus", 1),
+            "gpus": cls._int(sp, "gpus", 1),
+            "ram": str(sp.get("ram", "1G")),
+            "walltime": str(sp.get("walltime", "00:10:00")),
+            "job_name": str(sp.get("job_name") or cls.job_name),
+            "scratch_dir": str(sp.get("scratch_dir") or ""),
+            "projects_dir": str(sp.get("projects_dir") or ""),
+        })
         return base
 
 
 class SpacehpcBackend(BaseBackend):
-
-    def generate(self) -> None:
-        sp = SpacehpcConfig.from_merged(self.merged)
-
-        data_basename = self.top.data_dir.name
-        proj_basename = self.top.project_dir.name
-        img_basename = self.top.image.name
-        out_basename = self.top.output_dir.name
+    # the remote venv lives outside REMOTE_PROJ_DIR, which rsync --delete rewrites on every submit
+    MNT_VENV = "/venv"
+
+    def _in_project_mount(self, key: str) -> Optional[str]:
+        """Maps a configured local path inside the project dir to its location in the container."""
+        path = getattr(self.config, key)
+        if not path:
+            return None
+        try:
+            rel = path.absolute().relative_to(self.config.abs_project)
+        except ValueError:
+            raise ConfigError(
+                f"Config key {key} must be inside the project dir {self.config.abs_project} "
+                f"(only that dir is synced to the cluster), got: {path}"
+            ) from None
+        return f"{self.MNT_PROJECT}/{rel}"
+
+    def _bash_lc_payload(self) -> str:
+        _q = shlex.quote
+        exe = self.config.executable
+        steps = ["set -e", f"cd {self.MNT_PROJECT}"]
+        requirements = self._in_project_mount("requirements")
+        if requirements:
+            steps += [
+                f"[ -x {self.MNT_VENV}/bin/python ] || python3 -m venv {self.MNT_VENV}",
+                f"source {self.MNT_VENV}/bin/activate",
+                f"python3 -m pip install --requirement {_q(requirements)}",
+            ]
+        elif self.config.venv:
+            steps.append(f"source {self.MNT_VENV}/bin/activate")
+        steps.append(f"exec {"python3 " if exe.endswith(".py") else ""}{_q(f"{self.MNT_PROJECT}/{exe}")}")
+        return _q("\n".join(steps))
+
+    def generate(self) -> Path:
+        sp = self.config
+
+        # resolved once in BaseConfig.__post_init__()
+        local_project_dir = sp.abs_project
+        local_data_dir = sp.abs_data_dir
+        local_output_dir = sp.abs_output_dir
+
+        data_basename = local_data_dir.name
+        proj_basename = local_project_dir.name
+        img_basename = sp.image.name
+        out_basename = local_output_dir.name
+        use_venv = bool(sp.requirements or sp.venv)
+        venv_basename = sp.abs_venv.name if sp.abs_venv else sp.venv_default_remote
+        venv_bind = f'  --bind "$REMOTE_VENV_DIR:{self.MNT_VENV}" \\\n' if use_venv else ""
+
+        files = []
 
         # PBS script (still uses apptainer directly on remote)
-        self.writer.write_text(
+        files.append((
             "job.pbs",
             f"""#!/usr/bin/env bash
 #PBS -N {sp.job_name}
@@ -73,6 +126,7 @@ set -euo pipefail
 : "${{REMOTE_DATA_DIR:?}}"
 : "${{REMOTE_OUT_DIR:?}}"
 : "${{REMOTE_IMAGE:?}}"
+{': "${REMOTE_VENV_DIR:?}"' if use_venv else ""}
 
 cd "$REMOTE_PROJ_DIR"
 mkdir -p "$REMOTE_OUT_DIR"
@@ -81,17 +135,17 @@ apptainer exec \\
   --bind "$REMOTE_PROJ_DIR:/project" \\
   --bind "$REMOTE_DATA_DIR:/data" \\
   --bind "$REMOTE_OUT_DIR:/output" \\
-  "$REMOTE_IMAGE" \\
-  bash -lc {self.payload}
+{venv_bind}  "$REMOTE_IMAGE" \\
+  bash -lc {self._bash_lc_payload()}
 """,
-            mode=0o755,
-        )
+            0o755,
+        ))
 
         # Remote base dirs:
-        scratch_expr = shquote(self.top.scratch_dir) if self.top.scratch_dir else '${SPACEHPC_SCRATCH_BASE:-/scratch}'
-        projects_expr = shquote(self.top.projects_dir) if self.top.projects_dir else '${SPACEHPC_PROJECTS_BASE:-/shared/projects}'
+        scratch_expr = shquote(sp.scratch_dir) if sp.scratch_dir else '${SPACEHPC_SCRATCH_BASE:-/scratch}'
+        projects_expr = shquote(sp.projects_dir) if sp.projects_dir else '${SPACEHPC_PROJECTS_BASE:-/shared/projects}'
 
-        self.writer.write_text(
+        files.append((
             "submit_spacehpc.sh",
             f"""#!/usr/bin/env bash
 set -euo pipefail
@@ -99,12 +153,12 @@ set -euo pipefail
 LOGIN_NODE={shquote(sp.login_node)}
 USER={shquote(sp.user)}
 SSH_KEY={shquote(str(sp.ssh_key))}
-PROJECT={shquote(sp.project)}
+PROJECT={shquote(sp.pbs_project)}
 
-LOCAL_PROJECT_DIR={shquote(str(self.top.project_dir))}
-LOCAL_DATA_DIR={shquote(str(self.top.data_dir))}
-LOCAL_IMAGE={shquote(str(self.top.image))}
-LOCAL_OUTPUT_DIR={shquote(str(self.top.output_dir))}
+LOCAL_PROJECT_DIR={shquote(str(local_project_dir))}
+LOCAL_DATA_DIR={shquote(str(local_data_dir))}
+LOCAL_IMAGE={shquote(str(sp.image))}
+LOCAL_OUTPUT_DIR={shquote(str(local_output_dir))}
 
 REMOTE_SCRATCH_BASE={scratch_expr}
 REMOTE_PROJECTS_BASE={projects_expr}
@@ -117,29 +171,40 @@ REMOTE_OUT_DIR="$REMOTE_SCRATCH_ROOT/{shquote(out_basename)}"
 REMOTE_PROJ_DIR="$REMOTE_PROJECT_ROOT/{shquote(proj_basename)}"
 REMOTE_IMAGE_DIR="$REMOTE_PROJECT_ROOT/images"
 REMOTE_IMAGE="$REMOTE_IMAGE_DIR/{shquote(img_basename)}"
-
-ssh -i "$SSH_KEY" -o BatchMode=yes -o StrictHostKeyChecking=accept-new "$USER@$LOGIN_NODE" \\
-  "mkdir -p \\"$REMOTE_SCRATCH_ROOT\\" \\"$REMOTE_PROJECT_ROOT\\" \\"$REMOTE_IMAGE_DIR\\" \\"$REMOTE_OUT_DIR\\"" >/dev/null
-
-rsync -a --delete -e "ssh -i $SSH_KEY -o StrictHostKeyChecking=accept-new" \\
+REMOTE_GEN_DIR="$REMOTE_PROJECT_ROOT/.hpc_submit_gen"
+REMOTE_VENV_DIR="$REMOTE_PROJECT_ROOT/{shquote(venv_basename)}"
+
+# All ssh/rsync calls below share one multiplexed connection: the first
+# one opens the control socket, the rest reuse it instead of re-authenticating.
+# The socket name is ours alone, so a master opened elsewhere with another
+# identity is never reused; %C hashes user/host/port to stay short.
+SSH_OPTS=(-i "$SSH_KEY" -o BatchMode=yes -o StrictHostKeyChecking=accept-new
+  -o ControlMaster=auto -o "ControlPath=~/.ssh/hpc_submit-%C" -o ControlPersist=60s)
+# rsync -e takes one string and honours quotes (not backslashes), so quote each option
+RSYNC_RSH="ssh"
+for opt in "${{SSH_OPTS[@]}}"; do RSYNC_RSH+=" '$opt'"; done
+
+ssh "${{SSH_OPTS[@]}}" "$USER@$LOGIN_NODE" \\
+  "mkdir -p \\"$REMOTE_SCRATCH_ROOT\\" \\"$REMOTE_PROJECT_ROOT\\" \\"$REMOTE_IMAGE_DIR\\" \\"$REMOTE_OUT_DIR\\" \\"$REMOTE_GEN_DIR\\" \\"$REMOTE_VENV_DIR\\"" >/dev/null
+
+rsync -a --delete -e "$RSYNC_RSH" \\
   "$LOCAL_DATA_DIR/" "$USER@$LOGIN_NODE:$REMOTE_DATA_DIR/"
 
-rsync -a --delete -e "ssh -i $SSH_KEY -o StrictHostKeyChecking=accept-new" \\
+rsync -a --delete -e "$RSYNC_RSH" \\
   "$LOCAL_PROJECT_DIR/" "$USER@$LOGIN_NODE:$REMOTE_PROJ_DIR/"
 
-rsync -a -e "ssh -i $SSH_KEY -o StrictHostKeyChecking=accept-new" \\
+rsync -a -e "$RSYNC_RSH" \\
   "$LOCAL_IMAGE" "$USER@$LOGIN_NODE:$REMOTE_IMAGE"
 
-REMOTE_GEN_DIR="$REMOTE_PROJECT_ROOT/.hpc_submit_gen"
-ssh -i "$SSH_KEY" -o BatchMode=yes -o StrictHostKeyChecking=accept-new "$USER@$LOGIN_NODE" \\
-  "mkdir -p \\"$REMOTE_GEN_DIR\\"" >/dev/null
-
-scp -i "$SSH_KEY" -o StrictHostKeyChecking=accept-new {shquote(str(self.writer.outdir / "job.pbs"))} \\
-  "$USER@$LOGIN_NODE:$REMOTE_GEN_DIR/job.pbs" >/dev/null
+rsync -a -e "$RSYNC_RSH" {shquote(str(self.writer.path("job.pbs").absolute()))} \\
+  "$USER@$LOGIN_NODE:$REMOTE_GEN_DIR/job.pbs"
 
-ssh -i "$SSH_KEY" -o BatchMode=yes -o StrictHostKeyChecking=accept-new "$USER@$LOGIN_NODE" \\
-  "qsub -v REMOTE_PROJECTS_BASE=\\"$REMOTE_PROJECTS_BASE\\",REMOTE_SCRATCH_BASE=\\"$REMOTE_SCRATCH_BASE\\",SPACEHPC_PROJECT=\\"$PROJECT\\",SPACEHPC_USER=\\"$USER\\",REMOTE_PROJ_DIR=\\"$REMOTE_PROJ_DIR\\",REMOTE_DATA_DIR=\\"$REMOTE_DATA_DIR\\",REMOTE_OUT_DIR=\\"$REMOTE_OUT_DIR\\",REMOTE_IMAGE=\\"$REMOTE_IMAGE\\" \\
+ssh "${{SSH_OPTS[@]}}" "$USER@$LOGIN_NODE" \\
+  "qsub -v REMOTE_PROJECTS_BASE=\\"$REMOTE_PROJECTS_BASE\\",REMOTE_SCRATCH_BASE=\\"$REMOTE_SCRATCH_BASE\\",SPACEHPC_PROJECT=\\"$PROJECT\\",SPACEHPC_USER=\\"$USER\\",REMOTE_PROJ_DIR=\\"$REMOTE_PROJ_DIR\\",REMOTE_DATA_DIR=\\"$REMOTE_DATA_DIR\\",REMOTE_OUT_DIR=\\"$REMOTE_OUT_DIR\\",REMOTE_IMAGE=\\"$REMOTE_IMAGE\\",REMOTE_VENV_DIR=\\"$REMOTE_VENV_DIR\\" \\
     \\"$REMOTE_GEN_DIR/job.pbs\\"" 
 """,
-            mode=0o755,
-        )
+            0o755,
+        ))
+
+        *_, submit_script = self.writer.write_batch(files)
+        return submit_script
@@ -3,20 +3,27 @@ from __future__ import annotations
 
 import argparse
 import importlib
+import io
 import os
 import shlex
+import sys
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Self, Tuple, Type, TypeVar
+from typing import TYPE_CHECKING
 
-import yaml
+if TYPE_CHECKING:
+    from typing import Any, Dict, List, Optional, Self, Tuple, Type, TypeVar
 
-DEFAULT_CONFIG_NAME = f"hpc_submit.conf"
+    C = TypeVar("C", bound="BaseConfig")
 
-CONFIG_GLOBAL = Path(__file__).resolve().parent / f"{DEFAULT_CONFIG_NAME}"
+DEFAULT_CONFIG_NAME = "hpc_submit.conf"
+
+CONFIG_GLOBAL = Path(__file__).resolve().parent / DEFAULT_CONFIG_NAME
 CONFIG_USER = f"~/.config/hpc_submit/{DEFAULT_CONFIG_NAME}"
-CONFIG_PROJECT = f"{DEFAULT_CONFIG_NAME}"
+CONFIG_PROJECT = DEFAULT_CONFIG_NAME
+CONFIG_USER_PATH = Path(CONFIG_USER).expanduser()
 
 
 
@@ -24,6 +31,18 @@ def shquote(s: str) -> str:
     return shlex.quote(s)
 
 
+_yaml_loader: Optional[type] = None
+
+
+def yaml_load(stream: Any) -> Any:
+    """Safe-loads YAML, importing PyYAML on first use (libyaml loader when available)."""
+    global _yaml_loader
+    import yaml
+    if _yaml_loader is None:
+        _yaml_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    return yaml.load(stream, Loader=_yaml_loader)
+
+
 class ConfigError(RuntimeError):
     pass
 
@@ -37,34 +56,53 @@ class ConfigError(RuntimeError):
 class ConfigParser:
     """Loads YAML layers and deep-merges them (dict-recursive; lists/scalars replaced)."""
 
-    def load_yaml_if_exists(self, path: Path) -> Dict[str, Any]:
-        if not path.exists():
+    @classmethod
+    def load_yaml_if_exists(cls, path: Path) -> Dict[str, Any]:
+        try:
+            raw = path.read_bytes()
+        except (FileNotFoundError, NotADirectoryError):
             return {}
-        data = yaml.safe_load(path.read_text(encoding="utf-8"))
+        # placeholder files (empty, whitespace or comments only) parse to nothing
+        if not any(line.strip() and not line.lstrip().startswith(b"#") for line in io.BytesIO(raw)):
+            return {}
+        data = yaml_load(raw)
         if data is None:
             return {}
         if not isinstance(data, dict):
             raise ConfigError(f"Config {path} must be a YAML mapping at top-level")
         return data
 
-    def deep_merge(self, base: Any, override: Any) -> Any:
-        if isinstance(base, dict) and isinstance(override, dict):
-            out = dict(base)
-            for k, v in override.items():
-                out[k] = self.deep_merge(out[k], v) if k in out else v
-            return out
-        return override
+    @classmethod
+    def deep_merge(cls, base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+        """Merges override into base in place and returns base; nested dicts are merged, anything else replaced.
+
+        Nested dicts are copied into base rather than referenced, so base never shares a
+        mapping with a layer (YAML aliases can make one dict appear under several keys).
+        """
+        stack = [(base, override)]
+        while stack:
+            dst, src = stack.pop()
+            for k, v in src.items():
+                if isinstance(v, dict):
+                    cur = dst.get(k)
+                    if not isinstance(cur, dict):
+                        cur = dst[k] = {}
+                    stack.append((cur, v))
+                else:
+                    dst[k] = v
+        return base
 
-    def load_merged(self, global_cfg: Path, user_cfg: Path, project_cfg: Optional[Path], cli_overrides: Dict[str, Any]) -> Dict[str, Any]:
+    @classmethod
+    def load_merged(cls, global_cfg: Path, user_cfg: Path, project_cfg: Optional[Path], cli_overrides: Dict[str, Any]) -> Dict[str, Any]:
         #if not global_cfg.exists():
         #    raise ConfigError(f"Global config missing: {global_cfg}")
 
         merged: Dict[str, Any] = {}
-        merged = self.deep_merge(merged, self.load_yaml_if_exists(global_cfg))
-        merged = self.deep_merge(merged, self.load_yaml_if_exists(user_cfg))
-        if project_cfg and project_cfg.exists():
-            merged = self.deep_merge(merged, self.load_yaml_if_exists(project_cfg))
-        merged = self.deep_merge(merged, cli_overrides)
+        cls.deep_merge(merged, cls.load_yaml_if_exists(global_cfg))
+        cls.deep_merge(merged, cls.load_yaml_if_exists(user_cfg))
+        if project_cfg:
+            cls.deep_merge(merged, cls.load_yaml_if_exists(project_cfg))
+        cls.deep_merge(merged, cli_overrides)
         return merged
 
 
@@ -74,28 +112,31 @@ class ConfigParser:
 
 class CliOverrideParser:
     """Parses repeated --set key=value into nested dict via dotted keys; values parsed as YAML scalars."""
-    def parse(self, items: list[str]) -> Dict[str, Any]:
+    @classmethod
+    def parse(cls, items: list[str]) -> Dict[str, Any]:
+        from yaml import YAMLError
+
         out: Dict[str, Any] = {}
         for item in items:
-            if "=" not in item:
+            key, sep, value = item.partition("=")
+            if not sep:
                 raise ConfigError(f"--set expects KEY=VALUE, got: {item!r}")
-            key, value = item.split("=", 1)
             key = key.strip()
             if not key:
                 raise ConfigError(f"Empty key in --set: {item!r}")
 
             try:
-                parsed_value = yaml.safe_load(value)
-            except Exception:
+                parsed_value = yaml_load(value)
+            except YAMLError:
                 parsed_value = value
 
+            *parents, leaf = key.split(".")
             cur = out
-            parts = key.split(".")
-            for p in parts[:-1]:
-                if p not in cur or not isinstance(cur[p], dict):
-                    cur[p] = {}
-                cur = cur[p]
-            cur[parts[-1]] = parsed_value
+            for p in parents:
+                cur = cur.setdefault(p, {})
+                if not isinstance(cur, dict):
+                    raise ConfigError(f"--set {item!r} conflicts with an earlier non-mapping value for {p!r}")
+            cur[leaf] = parsed_value
         return out
 
 
@@ -115,6 +156,16 @@ class BaseConfig:
     requirements: str = ""
     venv: str = ""
     inputs: str = ""
+    # absolute forms of the paths above, resolved once in __post_init__()
+    abs_project: Optional[Path] = field(init=False, default=None)
+    abs_data_dir: Optional[Path] = field(init=False, default=None)
+    abs_output_dir: Optional[Path] = field(init=False, default=None)
+    abs_inputs: Optional[Path] = field(init=False, default=None)
+    abs_venv: Optional[Path] = field(init=False, default=None)
+
+    def __post_init__(self) -> None:
+        for key in ("project", "data_dir", "output_dir", "inputs", "venv"):
+            object.__setattr__(self, f"abs_{key}", self._abs(getattr(self, key)))
 
     @classmethod
     def _req(cls, d: Dict[str, Any], key: str) -> Any:
@@ -123,15 +174,38 @@ class BaseConfig:
         return d[key]
 
     @classmethod
-    def _path(self, merged: Dict[str, Any], key: str, prefix: Path = None):
-        path = None
-        s = (merged.get(key) or "").strip()
-        if s:
-            path = Path(s).expanduser()
-            if prefix and not path.is_absolute():
-                path = Path(prefix / s).expanduser()
+    def _int(cls, d: Dict[str, Any], key: str, default: int) -> int:
+        value = d.get(key)
+        if value in (None, ""):
+            return default
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ConfigError(f"Config key {key} must be an integer, got: {value!r}") from None
+
+    @classmethod
+    def _as_path(cls, value: Any) -> Path:
+        if isinstance(value, Path):
+            return value
+        s = value if isinstance(value, str) else str(value)
+        return Path(s).expanduser() if s.startswith("~") else Path(s)
+
+    @classmethod
+    def _path(cls, merged: Dict[str, Any], key: str, prefix: Path = None) -> Optional[Path]:
+        value = merged.get(key)
+        if isinstance(value, str):
+            value = value.strip()
+        if value in (None, ""):
+            return None
+        path = cls._as_path(value)
+        if prefix and not path.is_absolute():
+            path = prefix / path
         return path
 
+    @classmethod
+    def _abs(cls, path: Any) -> Optional[Path]:
+        return cls._as_path(path).absolute() if path else None
+
     @classmethod
     def parse(cls, merged: Dict[str, Any]) -> Dict[str, Any]:
         project = merged.get("project")
@@ -154,7 +228,7 @@ class BaseConfig:
             venv = venv,
             inputs = inputs,
             project = project,
-            mode = mode
+            mode = mode,
         )
 
     @classmethod
@@ -163,9 +237,6 @@ class BaseConfig:
         return cls(**base)
 
 
-C = TypeVar("C", bound=BaseConfig)
-
-
 class BaseBackend:
 
     PREFIX = ""
@@ -187,15 +258,16 @@ class BaseBackend:
     def _filename(self, name) -> str:
         return f"{self.PREFIX}_{name}"
     
-    def _get_singularity_binds(self) -> List[str]:
-        binds = [ f"{self.config.project.absolute()}:{self.MNT_PROJECT}" ]
-        if self.config.data_dir:
-            binds.append(f"{self.config.data_dir.absolute()}:{self.MNT_DATA}")
-        if self.config.output_dir:
-            binds.append(f"{self.config.output_dir.absolute()}:{self.MNT_OUTPUT}")
-        return binds
-
-    def _generate_venv(self) -> None:
+    @cached_property
+    def singularity_binds(self) -> Tuple[str, ...]:
+        binds = [ f"{self.config.abs_project}:{self.MNT_PROJECT}" ]
+        if self.config.abs_data_dir:
+            binds.append(f"{self.config.abs_data_dir}:{self.MNT_DATA}")
+        if self.config.abs_output_dir:
+            binds.append(f"{self.config.abs_output_dir}:{self.MNT_OUTPUT}")
+        return tuple(binds)
+
+    def _generate_venv(self) -> Tuple[str, str, int]:
         script = ""
         if self.config.requirements and self.config.venv:
             script = f"""
@@ -211,7 +283,7 @@ python3 -m pip install --upgrade pip
 python3 -m pip install --requirement $REQUIREMENTS
 """
         script_file = self._filename(self.FILE_VENV)
-        return self.writer.write_text(script_file, script, mode=0o755)
+        return script_file, script, 0o755
 
     def generate(self) -> Path:
         raise NotImplementedError
@@ -222,10 +294,35 @@ class ArtifactWriter:
         self.outdir = outdir
         self.outdir.mkdir(parents=True, exist_ok=True)
 
+    def path(self, name: str) -> Path:
+        return self.outdir / name
+
     def write_text(self, name: str, content: str, mode: int = 0o644) -> Path:
-        p = self.outdir / name
-        p.write_text(content.lstrip(), encoding="utf-8")
-        os.chmod(p, mode)
+        return self._write(name, content, mode)
+
+    def write_batch(self, files: List[Tuple[str, str, int]]) -> List[Path]:
+        """Writes (name, content, mode) artifacts back-to-back, in order."""
+        if os.open not in os.supports_dir_fd:
+            return [self._write(name, content, mode) for name, content, mode in files]
+        # resolve the output dir once; each file is then opened relative to it
+        dir_fd = os.open(self.outdir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            return [self._write(name, content, mode, dir_fd) for name, content, mode in files]
+        finally:
+            os.close(dir_fd)
+
+    def _write(self, name: str, content: str, mode: int, dir_fd: Optional[int] = None) -> Path:
+        p = self.path(name)
+        fd = os.open(name if dir_fd is not None else p, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode, dir_fd=dir_fd)
+        try:
+            data = memoryview(content.lstrip().encode("utf-8"))
+            while data:
+                # os.write may write fewer bytes than given; keep going until done
+                data = data[os.write(fd, data):]
+            # open()'s mode only applies to new files and is masked by umask
+            os.fchmod(fd, mode)
+        finally:
+            os.close(fd)
         return p
 
 # -----------------------------
@@ -237,8 +334,12 @@ def load_backend_classes(mode: str) -> Tuple[Type, Type]:
     Imports backends/<mode>.py and retrieves:
       <Mode>Config and <Mode>Backend
     """
-    mode = mode.strip()
-    module_name = f"backends.{mode.lower()}"
+    return _load_backend_classes(mode.strip().lower())
+
+
+@lru_cache(maxsize=None)
+def _load_backend_classes(mode: str) -> Tuple[Type, Type]:
+    module_name = f"backends.{mode}"
     module = importlib.import_module(module_name)
 
     prefix = mode.capitalize()
@@ -259,39 +360,40 @@ def load_backend_classes(mode: str) -> Tuple[Type, Type]:
 # Main
 # -----------------------------
 
-def resolve_project_cfg(args) -> Optional[Path]:
+def resolve_project_cfg(args, project: Path) -> Optional[Path]:
     if args.project_config:
         return Path(args.project_config).expanduser()
     else:
-        return Path(args.project).expanduser() / CONFIG_PROJECT
+        return project / CONFIG_PROJECT
 
 
-def main(argv: Optional[list[str]] = None) -> int:
+@lru_cache(maxsize=1)
+def _build_argparser() -> argparse.ArgumentParser:
     ap = argparse.ArgumentParser(description="Generate submit artifacts for HTCondor or SpaceHPC (plugin-based).")
     ap.add_argument("mode", help='Mode: "htcondor" or "spacehpc"')
     ap.add_argument("project", help='Path to the project')
     ap.add_argument("--project-config", default="")
     ap.add_argument("--set", action="append", default=[], help="Override config key via KEY=VALUE (repeatable). Dotted keys supported.")
     ap.add_argument("--outdir", default="", help="Artifacts output dir (default: <project_dir>/hpc_submit)")
-    
-    args = ap.parse_args(argv)
+    return ap
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = _build_argparser().parse_args(argv)
     
     mode = args.mode.strip().lower()
     project = Path(args.project).expanduser()
-    outdir = Path(args.outdir).expanduser() if args.outdir else Path(project / "hpc_submit").expanduser()
-
-    global_cfg = Path(CONFIG_GLOBAL).expanduser()
-    user_cfg = Path(CONFIG_USER).expanduser()
-    project_cfg = resolve_project_cfg(args)
+    outdir = Path(args.outdir).expanduser() if args.outdir else project / "hpc_submit"
+    project_cfg = resolve_project_cfg(args, project)
 
-    overrides = CliOverrideParser().parse(args.set)
-    merged = ConfigParser().load_merged(global_cfg, user_cfg, project_cfg, overrides)
+    overrides = CliOverrideParser.parse(args.set)
+    merged = ConfigParser.load_merged(CONFIG_GLOBAL, CONFIG_USER_PATH, project_cfg, overrides)
     merged.update({
         "project": project,
         "mode": mode
     })
     
-    ConfigClass, BackendClass = load_backend_classes(args.mode)
+    ConfigClass, BackendClass = load_backend_classes(mode)
     config = ConfigClass.from_merged(merged)
     writer = ArtifactWriter(outdir)
     backend = BackendClass(config, writer)
@@ -301,4 +403,7 @@ def main(argv: Optional[list[str]] = None) -> int:
 
 
 if __name__ == "__main__":
+    # Backends do `from hpc_submit import ...`; alias this module so that import
+    # reuses it instead of executing the file a second time as a separate module.
+    sys.modules.setdefault("hpc_submit", sys.modules[__name__])
     raise SystemExit(main())